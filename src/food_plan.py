@@ -1,26 +1,234 @@
+import csv
 from collections import UserList
-from typing import Iterable, Collection, Mapping
+from pathlib import Path
+from typing import (
+    Callable, Dict, FrozenSet, Iterable, Iterator, Collection, List,
+    Mapping, MutableMapping, NamedTuple, Optional, Sequence, Tuple, overload)
+from weakref import WeakValueDictionary
 
-from .nutritional_info import NutrientInfo, VOID_NUTRIENT
-from .loss import Loss
+from sympy import Symbol  # type: ignore
 
+from .nutritional_info import (
+    Nutrient, NutrientInfo, VOID_NUTRIENT_INFO, parse_nutrient)
+from .loss import AlgebraicLoss, Loss, Hessian, Target
 
-class Food(NutrientInfo):
-    def __init__(
-            self, name: str, data: NutrientInfo, amount: float = 0) -> None:
-        super().__init__(data)
+
+class Composition(Mapping[Nutrient, float]):
+    """
+    Immutable nutrient content of 100g of a food
+
+    Instances are interned, so foods with equal compositions share one object
+    """
+    __slots__ = ('__data', '__hash', '__weakref__')
+    __interned: MutableMapping[frozenset, 'Composition'] =\
+        WeakValueDictionary()
+
+    def __init__(self, data: Mapping[Nutrient, float]) -> None:
+        self.__data = dict(data)
+        self.__hash = hash(frozenset(self.__data.items()))
+
+    @staticmethod
+    def of(data: Mapping[Nutrient, float]) -> 'Composition':
+        if isinstance(data, Composition):
+            return data
+        key = frozenset(data.items())
+        composition = Composition.__interned.get(key)
+        if composition is None:
+            composition = Composition(data)
+            Composition.__interned[key] = composition
+        return composition
+
+    def __getitem__(self, key: Nutrient) -> float:
+        return self.__data[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.__data
+
+    def __iter__(self) -> Iterator[Nutrient]:
+        return iter(self.__data)
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Composition):
+            return self is other or self.__data == other.__data
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return self.__hash
+
+    def __reduce__(self) -> Tuple[Callable, Tuple[Dict[Nutrient, float]]]:
+        # re-intern on unpickling, so the hash matches this process's seed
+        return Composition.of, (self.__data,)
+
+    def dot(self, other: Mapping[Nutrient, float]) -> float:
+        if len(other) < len(self.__data):
+            return sum(self.__data.get(key, 0) * value
+                       for key, value in other.items())
+        return sum(other.get(key, 0) * value
+                   for key, value in self.__data.items())
+
+    def accumulate(self, buffer: MutableMapping[Nutrient, float],
+                   amount: float) -> MutableMapping[Nutrient, float]:
+        for key, value in self.__data.items():
+            buffer[key] = buffer.get(key, 0) + value * amount
+        return buffer
+
+    def project(self, symbols: Collection[Nutrient]) -> 'Composition':
+        return Composition.of({key: value for key, value in self.__data.items()
+                               if key in symbols})
+
+    def __repr__(self) -> str:
+        return f"Composition({self.__data})"
+
+
+class Food(Mapping[Nutrient, float]):
+    __slots__ = ('__name', '__composition', 'amount')
+
+    def __init__(self, name: str, data: Mapping[Nutrient, float],
+                 amount: float = 0) -> None:
         self.__name = name
+        self.__composition = Composition.of(data)
         self.amount = amount
 
     @property
     def name(self) -> str:
         return self.__name
 
+    @property
+    def composition(self) -> Composition:
+        return self.__composition
+
+    def __getitem__(self, key: Nutrient) -> float:
+        return self.__composition[key]
+
+    def __iter__(self) -> Iterator[Nutrient]:
+        return iter(self.__composition)
+
+    def __len__(self) -> int:
+        return len(self.__composition)
+
+    @overload
+    def __mul__(self, other: float) -> NutrientInfo:
+        ...
+    @overload  # noqa: F811, E301
+    def __mul__(self, other: Mapping[Nutrient, float]) -> float:
+        ...
+
+    def __mul__(self, other):  # noqa: F811
+        if isinstance(other, Mapping):
+            return self.__composition.dot(other)
+        if isinstance(other, (int, float)):
+            return NutrientInfo(self.__composition) * other
+        return NotImplemented
+
+    __rmul__ = __mul__
+
     def nutrients(self) -> NutrientInfo:
-        return self * self.amount
+        return self.accumulate(NutrientInfo())
+
+    def accumulate(self, buffer: MutableMapping[Nutrient, float],
+                   scale: float = 1) -> MutableMapping[Nutrient, float]:
+        """
+        Adds nutrients of the current amount of this food to the buffer
+
+        Does not allocate, so it is safe to call in tight loops
+        """
+        return self.__composition.accumulate(buffer, self.amount * scale)
+
+    def __repr__(self) -> str:
+        return f"Food(name={self.name!r}, amount={self.amount})"
+
+
+VOID_FOOD = Food("void", VOID_NUTRIENT_INFO)
+
+
+def read_catalog(source: Path) -> Dict[str, Composition]:
+    """
+    Reads a CSV of per-100g compositions, one food per line
 
+    The header names the nutrients of each column after the food name
+    """
+    catalog = {}
+    lines = source.read_text().split('\n')
+    reader = csv.reader(lines)
+    _, *names = next(reader)
+    nutrients = [parse_nutrient(name) for name in names]
+    for line in reader:
+        if not line:
+            continue
+        name, *values = line
+        catalog[name] = Composition.of(
+            {nutrient: float(value)
+             for nutrient, value in zip(nutrients, values) if value})
+    return catalog
 
-VOID_FOOD = Food("void", VOID_NUTRIENT)
+
+def loss_symbols(losses: Iterable[Loss]) -> Optional[FrozenSet[Symbol]]:
+    """
+    Union of the nutrients the losses depend on
+
+    None if some loss is not algebraic and may depend on any nutrient
+    """
+    symbols: FrozenSet[Symbol] = frozenset()
+    for loss in losses:
+        if not isinstance(loss, AlgebraicLoss):
+            return None
+        symbols |= loss.symbols
+    return symbols
+
+
+def solve_linear(matrix: Sequence[Sequence[float]],
+                 rhs: Sequence[float]) -> List[float]:
+    """
+    Solves a small dense linear system by Gaussian elimination
+    """
+    size = len(rhs)
+    rows = [list(row) + [value] for row, value in zip(matrix, rhs)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda row: abs(rows[row][col]))
+        if not rows[pivot][col]:
+            raise ValueError("Cannot solve singular linear system")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for row in range(col + 1, size):
+            factor = rows[row][col] / rows[col][col]
+            if factor:
+                for k in range(col, size + 1):
+                    rows[row][k] -= factor * rows[col][k]
+    solution = [0.] * size
+    for row in reversed(range(size)):
+        solution[row] = (rows[row][size] - sum(
+            rows[row][k] * solution[k] for k in range(row + 1, size))) /\
+            rows[row][row]
+    return solution
+
+
+class Solution(NamedTuple):
+    amounts: Mapping[str, float]
+    loss: float
+    iterations: int
+
+
+class Attribution(NamedTuple):
+    """
+    Per-food, per-loss breakdown of a plan's loss
+
+    Matrices are indexed [food][loss]. `contribution` is the amount times
+    the per-unit `gradient`, `leave_one_out` the exact change in each loss
+    if the food were removed. `deviation` is each target's signed distance
+    from its target (None for other losses) and `share` the part of it
+    each food makes up, its amount times its composition for a target
+    on a single nutrient
+    """
+    foods: List[str]
+    losses: List[Loss]
+    values: List[float]
+    gradient: List[List[float]]
+    contribution: List[List[float]]
+    leave_one_out: List[List[float]]
+    deviation: List[Optional[float]]
+    share: List[List[Optional[float]]]
 
 
 class FoodPlan(UserList, Collection[Food]):
@@ -28,14 +236,311 @@ class FoodPlan(UserList, Collection[Food]):
                  losses: Iterable[Loss] = ()) -> None:
         super().__init__(foods)
         self.losses = list(losses)
+        self.__losses: Tuple[Loss, ...] = ()
+        self.__symbols: Optional[FrozenSet[Symbol]] = frozenset()
+        self.__projections: Dict[Composition, Composition] = {}
+
+    @property
+    def symbols(self) -> Optional[FrozenSet[Symbol]]:
+        """
+        Nutrients the losses depend on, None if that is not known
+
+        Recomputed only when the losses change, but every access compares
+        the losses, so loops over foods use `projections` instead
+        """
+        losses = tuple(self.losses)
+        if losses != self.__losses:
+            self.__losses = losses
+            self.__symbols = loss_symbols(losses)
+            self.__projections = {}
+        return self.__symbols
+
+    def projected(self, food: Food) -> Composition:
+        """
+        Composition of the food restricted to the nutrients losses use
+        """
+        symbols = self.symbols
+        if symbols is None:
+            return food.composition
+        return self.__project(food.composition, symbols)
+
+    def projections(self) -> List[Composition]:
+        """
+        Projected compositions of all foods in order,
+        checking the losses for changes only once
+        """
+        symbols = self.symbols
+        if symbols is None:
+            return [food.composition for food in self.data]
+        return [self.__project(food.composition, symbols)
+                for food in self.data]
+
+    def __project(self, composition: Composition,
+                  symbols: FrozenSet[Symbol]) -> Composition:
+        projection = self.__projections.get(composition)
+        if projection is None:
+            projection = composition.project(symbols)
+            self.__projections[composition] = projection
+        return projection
+
+    def totals(self, buffer: Optional[NutrientInfo] = None,
+               pruned: bool = False) -> NutrientInfo:
+        if buffer is None:
+            buffer = NutrientInfo()
+        else:
+            buffer.clear()
+        if pruned:
+            # nutrients no food has are zero, not missing
+            buffer.update(dict.fromkeys(self.symbols or (), 0))
+            compositions = self.projections()
+        else:
+            compositions = [food.composition for food in self.data]
+        for food, composition in zip(self.data, compositions):
+            composition.accumulate(buffer, food.amount)
+        return buffer
 
     def total_loss(self) -> float:
-        value = sum(map(Food.nutrients, self.data), VOID_NUTRIENT)
+        value = self.totals(pruned=True)
         return sum(loss.loss(value) for loss in self.losses)
 
-    def gradient(self) -> Mapping[str, float]:
-        value = sum(map(Food.nutrients, self.data), VOID_NUTRIENT)
-        gradient = sum((loss.gradient(value) for loss in self.losses),
-                       VOID_NUTRIENT)
-        return {
-            food.name: food * gradient for food in self.data}
+    def nutrient_gradient(self, value: Optional[NutrientInfo] = None,
+                          dense: bool = False) -> NutrientInfo:
+        """
+        Gradient of the total loss with respect to nutrient totals
+
+        Only covers the nutrients losses use unless `dense` is set,
+        in which case every nutrient of every food gets an entry
+        """
+        if value is None:
+            value = self.totals(pruned=True)
+        gradient = NutrientInfo()
+        for loss in self.losses:
+            for key, second in loss.gradient(value, sparse=True).items():
+                gradient[key] += second
+        if dense:
+            for food in self.data:
+                for key in food.composition:
+                    if key not in gradient:
+                        gradient[key] = 0
+        return gradient
+
+    def gradient(self, nutrient_gradient: Optional[NutrientInfo] = None)\
+            -> Mapping[str, float]:
+        """
+        Gradient with respect to food amounts, from the given
+        nutrient gradient if there is one
+        """
+        if nutrient_gradient is None:
+            nutrient_gradient = self.nutrient_gradient()
+        return {food.name: composition.dot(nutrient_gradient)
+                for food, composition in zip(self.data, self.projections())}
+
+    def nutrient_hessian(self, value: Optional[NutrientInfo] = None)\
+            -> Hessian:
+        if value is None:
+            value = self.totals(pruned=True)
+        hessian: Hessian = {}
+        for loss in self.losses:
+            for key, second in loss.hessian(value).items():
+                hessian[key] = hessian.get(key, 0) + second
+        return hessian
+
+    def hessian(self) -> Dict[Tuple[str, str], float]:
+        """
+        Hessian with respect to food amounts, M^T H M for compositions M
+        """
+        hessian = self.nutrient_hessian()
+        compositions = self.projections()
+        result = {}
+        for food1, composition in zip(self.data, compositions):
+            column = NutrientInfo()
+            for (key0, key1), second in hessian.items():
+                if key1 in composition:
+                    column[key0] += second * composition[key1]
+            if not column:
+                continue
+            for food0, projection in zip(self.data, compositions):
+                second = projection.dot(column)
+                if second:
+                    result[food0.name, food1.name] = second
+        return result
+
+    def hessian_vector_product(
+            self, direction: Mapping[str, float]) -> Dict[str, float]:
+        value = self.totals(pruned=True)
+        compositions = self.projections()
+        vector = NutrientInfo()
+        for food, composition in zip(self.data, compositions):
+            step = direction.get(food.name, 0)
+            if step:
+                composition.accumulate(vector, step)
+        product = NutrientInfo()
+        for loss in self.losses:
+            product += loss.hessian_vector_product(value, vector)
+        return {food.name: composition.dot(product)
+                for food, composition in zip(self.data, compositions)}
+
+    def attribution(self) -> Attribution:
+        value = self.totals(pruned=True)
+        values = [loss.loss(value) for loss in self.losses]
+        gradients = [loss.gradient(value, sparse=True)
+                     for loss in self.losses]
+        deviation = [loss.deviation_value(value) if isinstance(loss, Target)
+                     else None for loss in self.losses]
+        gradient, contribution, leave_one_out, share = [], [], [], []
+        for food, composition in zip(self.data, self.projections()):
+            row = [composition.dot(grad) for grad in gradients]
+            gradient.append(row)
+            contribution.append([food.amount * grad for grad in row])
+            leave_one_out.append([
+                self.__without(loss, value, food) - current
+                for loss, current in zip(self.losses, values)])
+            share.append([
+                None if current is None else
+                current - self.__deviation_without(loss, value, food)
+                for loss, current in zip(self.losses, deviation)])
+        return Attribution(
+            [food.name for food in self.data], list(self.losses), values,
+            gradient, contribution, leave_one_out, deviation, share)
+
+    @staticmethod
+    def __without(loss: Loss, value: NutrientInfo, food: Food) -> float:
+        """
+        Loss of the totals without the food, only touching used nutrients
+        """
+        if not food.amount:
+            return loss.loss(value)
+        if isinstance(loss, AlgebraicLoss):
+            return float(loss.compiled_expression(
+                *(value[symbol] - food.amount * food.get(symbol, 0)
+                  for symbol in loss.ordered_symbols)))
+        return loss.loss(food.accumulate(NutrientInfo(value), -1))
+
+    @staticmethod
+    def __deviation_without(loss: Target, value: NutrientInfo,
+                            food: Food) -> float:
+        return float(loss.compiled_deviation(
+            *(value[symbol] - food.amount * food.get(symbol, 0)
+              for symbol in loss.deviation_symbols)))
+
+    def replace(self, name: str, food: Food,
+                totals: Optional[NutrientInfo] = None)\
+            -> Optional[NutrientInfo]:
+        """
+        Swaps the named food for another
+
+        Given the current totals, patches them in place instead of
+        requiring them to be recomputed
+        """
+        for i, old in enumerate(self.data):
+            if old.name == name:
+                break
+        else:
+            raise ValueError(f"No food named '{name}' in plan")
+        self.data[i] = food
+        if totals is not None:
+            old.composition.accumulate(totals, -old.amount)
+            food.composition.accumulate(totals, food.amount)
+        return totals
+
+    def amounts(self) -> Dict[str, float]:
+        return {food.name: food.amount for food in self.data}
+
+    def optimize(self, fixed: Optional[Mapping[str, float]] = None,
+                 speed: float = 0.1, max_iterations: int = 1000,
+                 tolerance: float = 1e-6, method: str = 'gradient',
+                 damping: float = 1e-3) -> Solution:
+        """
+        Minimizes total loss over nonnegative food amounts
+
+        Uses projected gradient descent, or damped projected Newton steps
+        if `method` is 'newton', halving each step until the loss decreases
+        enough. Starts from the current amounts; foods named in `fixed`
+        are pinned
+        """
+        if method not in ('gradient', 'newton'):
+            raise ValueError(f"Unknown optimization method '{method}'")
+        fixed = fixed or {}
+        for food in self.data:
+            if food.name in fixed:
+                food.amount = fixed[food.name]
+        iterations = 0
+        while iterations < max_iterations:
+            iterations += 1
+            gradient = self.gradient()
+            if method == 'newton':
+                step = self.newton_step(gradient, fixed, damping, speed)
+            else:
+                step = {name: speed * value
+                        for name, value in gradient.items()}
+            change = self.__backtrack(step, gradient, fixed)
+            if change < tolerance:
+                break
+        return Solution(self.amounts(), self.total_loss(), iterations)
+
+    def __move(self, start: Mapping[str, float], step: Mapping[str, float],
+               fixed: Mapping[str, float], scale: float = 1.) -> float:
+        change = 0.
+        for food in self.data:
+            if food.name in fixed:
+                continue
+            amount = max(0., start[food.name] - scale * step[food.name])
+            change = max(change, abs(amount - start[food.name]))
+            food.amount = amount
+        return change
+
+    def __backtrack(self, step: Mapping[str, float],
+                    gradient: Mapping[str, float],
+                    fixed: Mapping[str, float],
+                    shrink: float = 0.5, slope: float = 1e-4,
+                    max_halvings: int = 30) -> float:
+        """
+        Moves along the projected step, halving it until the loss
+        decreases enough (Armijo condition). Returns the largest change
+        in amount, 0 if no step was taken
+        """
+        start = self.amounts()
+        loss = self.total_loss()
+        scale = 1.
+        for _ in range(max_halvings):
+            change = self.__move(start, step, fixed, scale)
+            decrease = sum(gradient[food.name] *
+                           (start[food.name] - food.amount)
+                           for food in self.data)
+            if self.total_loss() <= loss - slope * decrease:
+                return change
+            scale *= shrink
+        self.__move(start, step, fixed, 0.)
+        return 0.
+
+    def newton_step(self, gradient: Mapping[str, float],
+                    fixed: Mapping[str, float],
+                    damping: float, speed: float = 0.1) -> Dict[str, float]:
+        """
+        Damped Newton step on the foods that can move
+
+        Falls back to the gradient scaled by `speed` where the Hessian on
+        those foods is zero, as for piecewise linear targets away from
+        their kinks, or where the Newton step is not a descent direction
+        """
+        free = [food.name for food in self.data
+                if food.name not in fixed and
+                (food.amount > 0 or gradient[food.name] < 0)]
+        fallback = {name: speed * value for name, value in gradient.items()}
+        hessian = self.hessian()
+        matrix = [[hessian.get((name0, name1), 0) for name1 in free]
+                  for name0 in free]
+        if not any(map(any, matrix)):
+            return fallback
+        for i, row in enumerate(matrix):
+            row[i] += damping
+        try:
+            solution = solve_linear(matrix, [gradient[name] for name in free])
+        except ValueError:
+            return fallback
+        if sum(gradient[name] * value
+               for name, value in zip(free, solution)) <= 0:
+            return fallback
+        step = dict.fromkeys(gradient, 0.)
+        step.update(zip(free, solution))
+        return step
@@ -3,23 +3,30 @@ from abc import abstractmethod
 from collections import defaultdict
 from pathlib import Path
 from typing import (
-    Type, Callable, Mapping, List, Set, Union, MutableMapping)
+    Type, Callable, Dict, Mapping, List, Sequence, Set, Tuple, Union)
 from warnings import warn
 
-from funcy import cached_readonly  # type: ignore
+from funcy import cached_property  # type: ignore
 from sympy import (  # type: ignore
-    sympify, S,
-    Symbol, Expr, Derivative, Piecewise, Lambda, Dummy)
+    sympify, lambdify, S,
+    Symbol, Expr, Piecewise, Lambda, Dummy, DiracDelta)
 
-from .nutritional_info import NutrientInfo, CALORIC_VALUE, ENERGY
+from .nutritional_info import (
+    NutrientInfo, CALORIC_VALUE, ENERGY, parse_nutrient)
 
 Gradient = NutrientInfo
+Hessian = Dict[Tuple[Symbol, Symbol], float]
 
 
 class StrOrType:
     def __getattr__(self, typ: Type) -> Type:
         return Union[str, typ]
 
+    def __getitem__(self, typ: Type) -> Type:
+        return Union[str, typ]
+
+    __call__ = __getitem__
+
 
 StrOr = StrOrType()
 
@@ -43,18 +50,49 @@ class Loss:
     def loss(self, value: NutrientInfo) -> float:
         pass
 
-    def gradient(self, nutrient_info: NutrientInfo) -> Gradient:
+    def gradient(self, nutrient_info: NutrientInfo,
+                 sparse: bool = False) -> Gradient:
+        """
+        Approximates the gradient by perturbing every nutrient
+
+        With `sparse` set, subclasses that know which nutrients they use
+        may leave out the zero entries for the rest
+        """
         current = self.loss(nutrient_info)
 
         def single_gradient(key: str, old_value: float):
+            step = self.epsilon * old_value if old_value else self.epsilon
             new_info = NutrientInfo(nutrient_info)
-            new_info[key] = old_value * (1 + self.epsilon) if old_value else self.epsilon
-            return (self.loss(new_info) -
-                    current) / (self.epsilon * old_value)
+            new_info[key] = old_value + step
+            return (self.loss(new_info) - current) / step
         return NutrientInfo(
             {key: single_gradient(key, value)
              for key, value in nutrient_info.items()})
 
+    def hessian(self, nutrient_info: NutrientInfo) -> Hessian:
+        """
+        Approximates the sparse Hessian by differencing gradients
+        """
+        current = self.gradient(nutrient_info)
+        hessian: Hessian = {}
+        for key, old_value in nutrient_info.items():
+            step = self.epsilon * (abs(old_value) or 1)
+            new_info = NutrientInfo(nutrient_info)
+            new_info[key] = old_value + step
+            for key1, value in self.gradient(new_info).items():
+                second = (value - current[key1]) / step
+                if second:
+                    hessian[key1, key] = second
+        return hessian
+
+    def hessian_vector_product(
+            self, nutrient_info: NutrientInfo,
+            vector: Mapping[Symbol, float]) -> Gradient:
+        product = Gradient()
+        for (key0, key1), value in self.hessian(nutrient_info).items():
+            product[key0] += value * vector.get(key1, 0)
+        return product
+
 
 class AlgebraicLoss(Loss):
     def __init__(self, expr, *args, **kwargs) -> None:
@@ -62,19 +100,74 @@ class AlgebraicLoss(Loss):
         self.__expression = sympify(expr)
 
     def subs(self, *args, **kwargs) -> 'AlgebraicLoss':
-        return AlgebraicLoss(self.expression.subs(*args, **kwargs))
+        return AlgebraicLoss(self.expression.subs(*args, **kwargs),
+                             epsilon=self.epsilon)
 
     @property
     def expression(self) -> Expr:
         return self.__expression
         
-    @cached_readonly
+    @cached_property
+    def compiled_expression(self) -> Callable[..., float]:
+        return lambdify(self.ordered_symbols, self.expression,
+                        modules='math')
+
+    @cached_property
+    def real_symbols(self) -> Mapping[Symbol, Symbol]:
+        return {symbol: symbol if symbol.is_real
+                else Dummy(symbol.name, real=True)
+                for symbol in self.symbols}
+
+    def derivative(self, expr: Expr, symbol: Symbol) -> Expr:
+        """
+        Differentiates treating all nutrients as real
+
+        Drops Dirac deltas, which are zero everywhere except at kinks
+        """
+        reals = self.real_symbols
+        derivative = expr.xreplace(reals).diff(reals[symbol])
+        return derivative.replace(DiracDelta, lambda *_: S.Zero).xreplace(
+            {real: symbol for symbol, real in reals.items()})
+
+    @cached_property
     def grad_exprs(self) -> Mapping[Symbol, Expr]:
         return defaultdict(
             lambda: S.Zero,
-            {symbol: Derivative(self.expression, symbol)
+            {symbol: self.derivative(self.expression, symbol)
              for symbol in self.symbols})
 
+    @cached_property
+    def compiled_gradient(self) -> Callable[..., List[float]]:
+        return lambdify(
+            self.ordered_symbols,
+            [self.grad_exprs[symbol] for symbol in self.ordered_symbols],
+            modules='math')
+
+    @cached_property
+    def hess_exprs(self) -> Mapping[Tuple[Symbol, Symbol], Expr]:
+        """
+        Nonzero second derivatives, listing both orders of each pair
+        """
+        ordered = self.ordered_symbols
+        hessian = {}
+        for i, symbol0 in enumerate(ordered):
+            for symbol1 in ordered[i:]:
+                expr = self.derivative(self.grad_exprs[symbol0], symbol1)
+                if expr != S.Zero:
+                    hessian[symbol0, symbol1] = hessian[symbol1, symbol0] =\
+                        expr
+        return hessian
+
+    @cached_property
+    def compiled_hessian(self) -> Callable[..., List[float]]:
+        return lambdify(self.ordered_symbols, list(self.hess_exprs.values()),
+                        modules='math')
+
+    def __getstate__(self) -> Dict[str, object]:
+        # derived and compiled properties are rebuilt on demand
+        return {key: value for key, value in self.__dict__.items()
+                if key.startswith('_')}
+
     def __eq__(self, other: object) -> bool:
         return (self.expression == other.expression
                 if isinstance(other, AlgebraicLoss)
@@ -83,10 +176,14 @@ class AlgebraicLoss(Loss):
     def __hash__(self) -> int:
         return hash(self.expression)
 
-    @cached_readonly
+    @cached_property
     def symbols(self) -> Set[Symbol]:
         return self.expression.free_symbols
 
+    @cached_property
+    def ordered_symbols(self) -> Tuple[Symbol, ...]:
+        return tuple(sorted(self.symbols, key=str))
+
     def ensure_sufficient(self, value: NutrientInfo) -> None:
         for symbol in self.symbols:
             if symbol not in value:
@@ -94,14 +191,27 @@ class AlgebraicLoss(Loss):
 
     def loss(self, value: NutrientInfo) -> float:
         self.ensure_sufficient(value)
-        return float(self.expression.subs(value))
+        return float(self.compiled_expression(
+            *(value[symbol] for symbol in self.ordered_symbols)))
 
-    def gradient(self, value: NutrientInfo) -> Gradient:
+    def gradient(self, value: NutrientInfo,
+                 sparse: bool = False) -> Gradient:
+        self.ensure_sufficient(value)
+        grad = Gradient() if sparse else Gradient(value.keys())
+        if self.symbols:
+            grad.update(zip(self.ordered_symbols, map(
+                float, self.compiled_gradient(
+                    *(value[symbol] for symbol in self.ordered_symbols)))))
+        return grad
+
+    def hessian(self, value: NutrientInfo) -> Hessian:
         self.ensure_sufficient(value)
-        grad: MutableMapping[Symbol, float] = defaultdict(lambda: 0)
-        for symbol in value:
-            grad[symbol] = float(self.grad_exprs[symbol].subs(value))
-        return Gradient(grad)
+        if not self.hess_exprs:
+            return {}
+        values = self.compiled_hessian(
+            *(value[symbol] for symbol in self.ordered_symbols))
+        return {key: float(second)
+                for key, second in zip(self.hess_exprs, values) if second}
 
     def __str__(self) -> str:
         return f"AlgebraicLoss(expression={self.expression})"
@@ -111,8 +221,11 @@ class AlgebraicLoss(Loss):
 
 
 class Target(AlgebraicLoss):
-    def __init__(self, expr, target, low_penalty, high_penalty) -> None:
-        expr, target, low_penalty, high_penalty =\
+    ARGUMENTS = ('expr', 'target', 'low_penalty', 'high_penalty')
+
+    def __init__(self, expr, target, low_penalty, high_penalty,
+                 *args, **kwargs) -> None:
+        self.__arguments = expr, target, low_penalty, high_penalty =\
             sympify((expr, target, low_penalty, high_penalty))
         if not callable(low_penalty):
             low_penalty = Lambda(Dummy(), low_penalty)
@@ -123,7 +236,70 @@ class Target(AlgebraicLoss):
         expression = lack *\
             Piecewise((low_penalty(lack), expr < target),
                       (high_penalty(lack), True))
-        super().__init__(expression)
+        super().__init__(expression, *args, **kwargs)
+        self.__deviation = expr - target
+
+    def subs(self, *args, **kwargs) -> 'Target':
+        """
+        Substitutes into the target's arguments, so the result
+        is still a Target
+        """
+        return Target(*(argument.subs(*args, **kwargs)
+                        for argument in self.__arguments),
+                      epsilon=self.epsilon)
+
+    @property
+    def arguments(self) -> Mapping[str, Expr]:
+        return dict(zip(self.ARGUMENTS, self.__arguments))
+
+    def replace(self, **arguments: Union[str, float, Expr]) -> 'Target':
+        """
+        The same target with some of its arguments replaced,
+        e.g. `target.replace(target=3000)`
+        """
+        unknown = set(arguments) - set(self.ARGUMENTS)
+        if unknown:
+            raise TypeError(f"Unknown Target arguments: {sorted(unknown)}")
+        return Target(**{**self.arguments, **arguments},
+                      epsilon=self.epsilon)
+
+    @property
+    def direction(self) -> int:
+        """
+        1 if more of the nutrient is never worse, -1 if less is never worse
+
+        0 if neither holds or the target is not on a single nutrient
+        against a constant
+        """
+        expr, target, low_penalty, high_penalty = self.__arguments
+        if (not isinstance(expr, Symbol) or target.free_symbols or
+                not low_penalty.is_number or not high_penalty.is_number):
+            return 0
+        if high_penalty == 0 and low_penalty != 0:
+            return 1
+        if low_penalty == 0 and high_penalty != 0:
+            return -1
+        return 0
+
+    @property
+    def deviation(self) -> Expr:
+        """
+        Signed distance from the target, negative for a shortfall
+        """
+        return self.__deviation
+
+    @cached_property
+    def compiled_deviation(self) -> Callable[..., float]:
+        return lambdify(self.deviation_symbols, self.deviation,
+                        modules='math')
+
+    @cached_property
+    def deviation_symbols(self) -> Tuple[Symbol, ...]:
+        return tuple(sorted(self.deviation.free_symbols, key=str))
+
+    def deviation_value(self, value: NutrientInfo) -> float:
+        return float(self.compiled_deviation(
+            *(value[symbol] for symbol in self.deviation_symbols)))
 
     @staticmethod
     def symmetric(key: StrOr(Symbol), target: Union[str, float],
@@ -198,22 +374,35 @@ TYPES: Mapping[str, Callable[..., Loss]] = {
     'target-relative-sym': Target.energy_fraction,
     'target-relative-to-sym': Target.relative_symmetric,
     'target-relative-to-asym': Target.relative}
+RELATIVE_TO = ('target-relative-to-sym', 'target-relative-to-asym')
+
+
+def reference_rows(source: Path) -> List[Tuple[str, ...]]:
+    return parse_reference_rows(source.read_text())
+
+
+def parse_reference_rows(text: str) -> List[Tuple[str, ...]]:
+    reader = csv.reader(text.split('\n'))
+    next(reader, None)  # header
+    return [tuple(line) for line in reader if line]
+
+
+def parse_reference_row(row: Sequence[str]) -> Loss:
+    nutrient, loss_type, *args = row
+    loss_type = loss_type or 'target-sym'
+    if loss_type not in TYPES:
+        raise ValueError(f"Unknown loss type '{loss_type}'")
+    if loss_type in RELATIVE_TO and args:
+        args[0] = parse_nutrient(args[0])
+    return TYPES[loss_type](parse_nutrient(nutrient), *args)
 
 
 def read_reference(source: Path) -> List[Loss]:
-    losses = []
-    lines = source.read_text().split('\n')
-    for line in csv.reader(lines):
-        if not line:
-            continue
-        nutrient, loss_type, *args = line
-        loss_type = loss_type or 'target-sym'
-        losses.append(TYPES[loss_type](nutrient, *args))
-    return losses
+    return [parse_reference_row(row) for row in reference_rows(source)]
 
 
-def read_all_references(source: Path) -> Mapping[str, List[Loss]]:
-    losses = {}
+def read_choices(source: Path) -> Dict[str, Path]:
+    choices = {}
     lines = source.read_text().split('\n')
     for line in csv.reader(lines):
         if not line:
@@ -221,5 +410,11 @@ def read_all_references(source: Path) -> Mapping[str, List[Loss]]:
         name, pathname, *rest = line
         if rest:
             warn(f"Unexpected values: {rest}")
-        losses[name] = read_reference(Path(pathname))
-    return losses
+        # relative paths are relative to the choices file
+        choices[name] = source.parent / pathname
+    return choices
+
+
+def read_all_references(source: Path) -> Mapping[str, List[Loss]]:
+    return {name: read_reference(path)
+            for name, path in read_choices(source).items()}
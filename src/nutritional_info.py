@@ -1,17 +1,62 @@
+import csv
 import math
 from collections import UserDict
+from functools import lru_cache
 from itertools import chain
 from operator import mul
-from typing import (Union, overload, Mapping, Iterable, MutableMapping)
+from pathlib import Path
+from typing import (
+    Dict, Tuple, Union, overload, Mapping, Iterable, MutableMapping)
 
 from funcy import partial, merge_with, walk_keys, walk_values  # type: ignore
 from sympy import Symbol  # type: ignore
 
 
 class Nutrient(Symbol):
-    def __init__(self, name: str) -> None:
-        super().__init__(name, real=True)
-    
+    def __new__(cls, name: str) -> 'Nutrient':
+        # sympy builds symbols in __new__; __init__ gets no assumptions
+        return super().__new__(cls, name, real=True)
+
+    def __getnewargs_ex__(self) -> Tuple[Tuple[str], Dict[str, bool]]:
+        return (self.name,), {}
+
+
+NUTRIENT_NAMES = Path(__file__).parent.parent / 'data' / 'nutrient-names.csv'
+
+
+def read_nutrient_names(source: Path) -> Dict[str, str]:
+    """
+    Maps each name of a nutrient to its canonical name
+
+    Every line lists the canonical name followed by its aliases
+    """
+    names = {}
+    for line in csv.reader(source.read_text().split('\n')):
+        if not line:
+            continue
+        canonical = line[0].strip()
+        for name in line:
+            names[name.strip()] = canonical
+    return names
+
+
+@lru_cache(maxsize=None)
+def _nutrient_names() -> Dict[str, str]:
+    if not NUTRIENT_NAMES.exists():
+        return {}
+    return read_nutrient_names(NUTRIENT_NAMES)
+
+
+def parse_nutrient(name: str) -> Nutrient:
+    """
+    Nutrient for a name as written in reference and catalog files
+
+    Aliases resolve to the canonical name; names may contain spaces,
+    which sympify would reject
+    """
+    name = name.strip()
+    return Nutrient(_nutrient_names().get(name, name))
+
 
 class NutrientInfo(UserDict, MutableMapping[Nutrient, float]):
     def __init__(self, values: Union[Mapping[Nutrient, float],
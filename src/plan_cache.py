@@ -0,0 +1,134 @@
+from collections import Counter, OrderedDict
+from typing import (
+    Any, FrozenSet, Mapping, NamedTuple, Optional, Tuple)
+
+from .food_plan import Composition, FoodPlan, Solution
+
+FoodsKey = FrozenSet[Tuple[str, Composition]]
+
+
+class Fingerprint(NamedTuple):
+    losses: FrozenSet
+    foods: FoodsKey
+    constraints: FrozenSet[Tuple[str, float]]
+    options: FrozenSet[Tuple[str, Any]] = frozenset()
+
+    @staticmethod
+    def of(plan: FoodPlan, fixed: Optional[Mapping[str, float]] = None,
+           options: Optional[Mapping[str, Any]] = None) -> 'Fingerprint':
+        return Fingerprint(
+            frozenset(Counter(plan.losses).items()),
+            frozenset((food.name, food.composition) for food in plan),
+            frozenset((fixed or {}).items()),
+            frozenset((options or {}).items()))
+
+
+class CacheStats(NamedTuple):
+    hits: int = 0
+    warm_starts: int = 0
+    misses: int = 0
+    iterations: int = 0
+    iterations_saved: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.hits + self.warm_starts + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.requests if self.requests else 0.
+
+
+class _Entry(NamedTuple):
+    solution: Solution
+    cold_iterations: int
+
+
+class SolutionCache:
+    """
+    LRU cache of FoodPlan solutions
+
+    Near-misses (same losses and solver options, overlapping foods) are
+    warm-started from the cached solution sharing the most foods
+    """
+    def __init__(self, maxsize: int = 128) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"Cannot use nonpositive cache size {maxsize}")
+        self.__maxsize = maxsize
+        self.__entries: 'OrderedDict[Fingerprint, _Entry]' = OrderedDict()
+        self.__stats = CacheStats()
+
+    @property
+    def maxsize(self) -> int:
+        return self.__maxsize
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.__stats
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def clear(self) -> None:
+        self.__entries.clear()
+        self.__stats = CacheStats()
+
+    def closest(self, key: Fingerprint)\
+            -> Optional[Tuple[Fingerprint, _Entry]]:
+        best, best_score = None, 0.
+        for other, entry in self.__entries.items():
+            if other.losses != key.losses or other.options != key.options:
+                continue
+            shared = len(other.foods & key.foods)
+            if not shared:
+                continue
+            score = shared / len(other.foods | key.foods)
+            if score > best_score:
+                best, best_score = (other, entry), score
+        if best is None:
+            return None
+        self.__entries.move_to_end(best[0])
+        return best
+
+    def solve(self, plan: FoodPlan,
+              fixed: Optional[Mapping[str, float]] = None,
+              **options: Any) -> Solution:
+        key = Fingerprint.of(plan, fixed, options)
+        entry = self.__entries.get(key)
+        if entry is not None:
+            self.__entries.move_to_end(key)
+            for food in plan:
+                food.amount = entry.solution.amounts[food.name]
+            self.__stats = self.__stats._replace(
+                hits=self.__stats.hits + 1,
+                iterations_saved=(self.__stats.iterations_saved +
+                                  entry.cold_iterations))
+            return entry.solution
+
+        closest = self.closest(key)
+        start = None if closest is None else closest[1]
+        for food in plan:
+            food.amount = 0
+            if (closest is not None and
+                    (food.name, food.composition) in closest[0].foods):
+                food.amount = start.solution.amounts[food.name]
+        solution = plan.optimize(fixed, **options)
+
+        stats = self.__stats._replace(
+            iterations=self.__stats.iterations + solution.iterations)
+        if start is None:
+            cold_iterations = solution.iterations
+            stats = stats._replace(misses=stats.misses + 1)
+        else:
+            cold_iterations = start.cold_iterations
+            stats = stats._replace(
+                warm_starts=stats.warm_starts + 1,
+                iterations_saved=(
+                    stats.iterations_saved +
+                    max(0, cold_iterations - solution.iterations)))
+        self.__stats = stats
+
+        self.__entries[key] = _Entry(solution, cold_iterations)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+        return solution
@@ -0,0 +1,161 @@
+from collections import defaultdict
+from itertools import chain
+from typing import (
+    Dict, Iterable, List, Mapping, MutableMapping, NamedTuple, Optional,
+    Tuple)
+
+from sympy import Symbol  # type: ignore
+
+from .food_plan import Food, FoodPlan, loss_symbols
+from .loss import AlgebraicLoss, Loss, Target
+
+Key = Tuple[Tuple[Symbol, float], ...]
+
+
+class Presolved(NamedTuple):
+    plan: FoodPlan
+    irrelevant: List[str]
+    forced_zero: List[str]
+    merged: Mapping[str, List[Tuple[str, float]]]
+    dominated: Mapping[str, str]
+
+    @property
+    def eliminated(self) -> int:
+        return (len(self.irrelevant) + len(self.forced_zero) +
+                len(self.dominated) +
+                sum(map(len, self.merged.values())))
+
+    def restore(self, amounts: Mapping[str, float]) -> Dict[str, float]:
+        """
+        Amounts for every food of the original plan
+
+        Eliminated foods get nothing, merged foods are left on
+        their representative
+        """
+        restored = dict(amounts)
+        for name in chain(self.irrelevant, self.forced_zero, self.dominated):
+            restored[name] = 0.
+        for members in self.merged.values():
+            for name, _ in members:
+                restored[name] = 0.
+        return restored
+
+
+def direction_key(food: Food, symbols: Tuple[Symbol, ...],
+                  digits: int = 12) -> Tuple[Key, float]:
+    """
+    Composition on the given nutrients scaled so the first nonzero is 1
+    """
+    values = [(symbol, food.get(symbol, 0)) for symbol in symbols
+              if food.get(symbol, 0)]
+    if not values:
+        return (), 0.
+    scale = values[0][1]
+    return (tuple((symbol, round(value / scale, digits))
+                  for symbol, value in values), scale)
+
+
+def dominates(food0: Food, food1: Food, symbols: Tuple[Symbol, ...],
+              directions: Mapping[Symbol, int]) -> bool:
+    """
+    Whether food0 is at least as good as food1 on every nutrient
+
+    Directions are 1 where more is never worse, -1 where less is never worse
+    and 0 (or missing) where the nutrient is not monotone
+    """
+    strict = False
+    for symbol in symbols:
+        value0, value1 = food0.get(symbol, 0), food1.get(symbol, 0)
+        if value0 == value1:
+            continue
+        direction = directions.get(symbol, 0)
+        if direction * (value0 - value1) <= 0:
+            return False
+        strict = True
+    return strict
+
+
+def loss_directions(losses: Iterable[Loss]) -> Dict[Symbol, int]:
+    """
+    Directions of the nutrients only single-nutrient targets depend on
+
+    A nutrient gets 1 if more of it is never worse for all of them,
+    -1 if less is never worse and is left out otherwise. Nothing is
+    known if some loss is not algebraic
+    """
+    directions: Dict[Symbol, int] = {}
+    excluded = set()
+    for loss in losses:
+        if not isinstance(loss, AlgebraicLoss):
+            return {}
+        direction = loss.direction if isinstance(loss, Target) else 0
+        if not direction or len(loss.symbols) != 1:
+            excluded.update(loss.symbols)
+            continue
+        symbol, = loss.symbols
+        if directions.setdefault(symbol, direction) != direction:
+            excluded.add(symbol)
+    return {symbol: direction for symbol, direction in directions.items()
+            if symbol not in excluded}
+
+
+def presolve(plan: FoodPlan,
+             fixed: Optional[Mapping[str, float]] = None) -> Presolved:
+    """
+    Shrinks the plan before optimization
+
+    Drops foods with no nutrient any loss uses, foods pinned to zero and
+    foods dominated by another food on nutrients the losses make
+    monotone. Foods whose relevant nutrients are proportional are merged
+    into one, with amounts carried over in units of the representative
+    """
+    fixed = fixed or {}
+    symbols = loss_symbols(plan.losses)
+    if symbols is None:
+        symbols = frozenset(
+            key for food in plan for key in food.composition)
+    ordered = tuple(sorted(symbols, key=str))
+
+    irrelevant, forced_zero = [], []
+    groups: MutableMapping[Key, List[Tuple[Food, float]]] = defaultdict(list)
+    pinned = []
+    for food in plan:
+        if food.name in fixed:
+            if fixed[food.name] == 0:
+                forced_zero.append(food.name)
+            else:
+                pinned.append(Food(food.name, food.composition,
+                                   fixed[food.name]))
+            continue
+        key, scale = direction_key(food, ordered)
+        if not key:
+            irrelevant.append(food.name)
+            continue
+        groups[key].append((food, scale))
+
+    merged: Dict[str, List[Tuple[str, float]]] = {}
+    candidates = []
+    for members in groups.values():
+        (representative, scale), *rest = members
+        amount = sum(food.amount * other / scale for food, other in members)
+        candidates.append(Food(representative.name,
+                               representative.composition, amount))
+        if rest:
+            merged[representative.name] = [
+                (food.name, other / scale) for food, other in rest]
+
+    dominated: Dict[str, str] = {}
+    directions = loss_directions(plan.losses)
+    if directions:
+        for food in candidates:
+            for other in candidates:
+                if (other is not food and other.name not in dominated and
+                        dominates(other, food, ordered, directions)):
+                    dominated[food.name] = other.name
+                    other.amount += food.amount
+                    break
+
+    foods = pinned + [food for food in candidates
+                      if food.name not in dominated]
+    return Presolved(FoodPlan(foods, plan.losses), irrelevant, forced_zero,
+                     merged, dominated)
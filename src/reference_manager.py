@@ -0,0 +1,145 @@
+import hashlib
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+from warnings import warn
+
+from .loss import (
+    Loss, parse_reference_row, parse_reference_rows, read_choices)
+
+Row = Tuple[str, ...]
+Snapshot = Mapping[str, Tuple[Loss, ...]]
+
+
+class ReloadStats(NamedTuple):
+    # reload() calls after the first that re-read some file
+    reloads: int = 0
+    rows_reused: int = 0
+    rows_rebuilt: int = 0
+
+
+class _Source(NamedTuple):
+    path: Path
+    stamp: Tuple[int, int]
+    digest: bytes
+    rows: List[Row]
+    losses: Tuple[Loss, ...]
+
+
+def _stamp(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+class ReferenceManager:
+    """
+    Keeps the references listed in a choices file up to date
+
+    Only rows that changed are parsed again; losses for unchanged rows,
+    with everything they have compiled, are reused. Readers take an
+    immutable snapshot, which a reload replaces without blocking them.
+    Files whose modification time and size look unchanged are still
+    compared by content, since an edit can land within one mtime tick
+    """
+    def __init__(self, choices: Path) -> None:
+        self.__choices = choices
+        self.__loaded = False
+        self.__paths: Dict[str, Path] = {}
+        self.__sources: Dict[str, _Source] = {}
+        self.__snapshot: Snapshot = MappingProxyType({})
+        self.__stats = ReloadStats()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__watcher: Optional[threading.Thread] = None
+        self.reload()
+
+    @property
+    def stats(self) -> ReloadStats:
+        return self.__stats
+
+    def snapshot(self) -> Snapshot:
+        return self.__snapshot
+
+    def reload(self) -> Set[str]:
+        """
+        Re-reads changed files and returns the names of changed references
+        """
+        with self.__lock:
+            # the choices file is small, so it is simply re-read
+            self.__paths = read_choices(self.__choices)
+            changed = set(self.__sources) - set(self.__paths)
+            sources = {name: source for name, source in self.__sources.items()
+                       if name in self.__paths}
+            rebuilt = False
+            for name, path in self.__paths.items():
+                source = sources.get(name)
+                stamp = _stamp(path)
+                data = None
+                if (source is not None and source.path == path and
+                        source.stamp == stamp):
+                    data = path.read_bytes()
+                    if _digest(data) == source.digest:
+                        continue
+                sources[name] = self.__rebuild(path, stamp, data)
+                rebuilt = True
+                if source is None or source.rows != sources[name].rows:
+                    changed.add(name)
+            self.__sources = sources
+            if rebuilt and self.__loaded:
+                self.__stats = self.__stats._replace(
+                    reloads=self.__stats.reloads + 1)
+            self.__loaded = True
+            if changed:
+                self.__snapshot = MappingProxyType(
+                    {name: source.losses for name, source in sources.items()})
+            return changed
+
+    def __rebuild(self, path: Path, stamp: Tuple[int, int],
+                  data: Optional[bytes] = None) -> _Source:
+        previous: Dict[Row, Loss] = {}
+        for source in self.__sources.values():
+            previous.update(zip(source.rows, source.losses))
+        if data is None:
+            data = path.read_bytes()
+        rows = parse_reference_rows(data.decode())
+        losses = []
+        reused = 0
+        for row in rows:
+            loss = previous.get(row)
+            if loss is None:
+                loss = previous[row] = parse_reference_row(row)
+            else:
+                reused += 1
+            losses.append(loss)
+        self.__stats = self.__stats._replace(
+            rows_reused=self.__stats.rows_reused + reused,
+            rows_rebuilt=self.__stats.rows_rebuilt + len(rows) - reused)
+        return _Source(path, stamp, _digest(data), rows, tuple(losses))
+
+    def watch(self, interval: float = 1.) -> None:
+        if self.__watcher is not None:
+            return
+        self.__stop.clear()
+
+        def run() -> None:
+            while not self.__stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as error:  # pylint: disable=broad-except
+                    # a file may be half-written: keep serving the last
+                    # good snapshot and retry on the next poll
+                    warn(f"Failed to reload references: {error}")
+        self.__watcher = threading.Thread(target=run, daemon=True)
+        self.__watcher.start()
+
+    def stop(self) -> None:
+        if self.__watcher is None:
+            return
+        self.__stop.set()
+        self.__watcher.join()
+        self.__watcher = None
@@ -0,0 +1,377 @@
+"""
+Long-running plan evaluation service
+
+Keeps references and the food catalog loaded, micro-batches evaluate and
+gradient requests and runs optimizations in a bounded process pool
+"""
+import json
+import math
+import queue
+import threading
+import time
+from argparse import ArgumentParser
+from collections import defaultdict, deque
+from concurrent import futures
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import (
+    Any, Deque, Dict, List, Mapping, MutableMapping, NamedTuple, Optional,
+    Tuple)
+
+from .food_plan import Composition, Food, FoodPlan, read_catalog
+from .loss import AlgebraicLoss
+from .nutritional_info import NutrientInfo
+from .reference_manager import ReferenceManager, Snapshot
+
+OPERATIONS = ('evaluate', 'gradient', 'optimize')
+OPTIONS = {'speed': float, 'max_iterations': int, 'tolerance': float,
+           'method': str, 'damping': float}
+PERCENTILES = (50, 90, 99)
+
+
+class PlanRequest(NamedTuple):
+    operation: str
+    reference: str
+    foods: Mapping[str, float]
+    fixed: Mapping[str, float] = {}
+    options: Mapping[str, Any] = {}
+
+    @staticmethod
+    def from_json(operation: str, body: Mapping[str, Any]) -> 'PlanRequest':
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{operation}'")
+        if not isinstance(body, Mapping):
+            raise ValueError("Request body must be an object")
+        reference = body.get('reference')
+        if not isinstance(reference, str):
+            raise ValueError("Request needs a reference name")
+        return PlanRequest(operation, reference,
+                           _amounts(body, 'foods'), _amounts(body, 'fixed'),
+                           _options(body))
+
+
+def _is_number(value: Any) -> bool:
+    return (isinstance(value, (int, float)) and
+            not isinstance(value, bool) and math.isfinite(value))
+
+
+def _amounts(body: Mapping[str, Any], field: str) -> Dict[str, float]:
+    amounts = body.get(field, {})
+    if not isinstance(amounts, Mapping) or not all(
+            isinstance(name, str) and _is_number(amount)
+            for name, amount in amounts.items()):
+        raise ValueError(f"'{field}' must map food names to numbers")
+    return {name: float(amount) for name, amount in amounts.items()}
+
+
+def _options(body: Mapping[str, Any]) -> Dict[str, Any]:
+    options = body.get('options', {})
+    if not isinstance(options, Mapping):
+        raise ValueError("'options' must be an object")
+    for name, value in options.items():
+        kind = OPTIONS.get(name)
+        if kind is None:
+            raise ValueError(f"Unknown option '{name}'")
+        if kind is str:
+            valid = isinstance(value, str)
+        else:
+            valid = _is_number(value) and (kind is float or
+                                           isinstance(value, int))
+        if not valid:
+            raise ValueError(f"Option '{name}' must be of type "
+                             f"{kind.__name__}")
+    return dict(options)
+
+
+class Metrics:
+    def __init__(self, window: int = 1000) -> None:
+        self.__lock = threading.Lock()
+        self.__latencies: MutableMapping[str, Deque[float]] =\
+            defaultdict(lambda: deque(maxlen=window))
+        self.__counts: MutableMapping[str, int] = defaultdict(int)
+        self.__max_queue_depth = 0
+        self.__batches = 0
+        self.__batched = 0
+
+    def record(self, operation: str, seconds: float) -> None:
+        with self.__lock:
+            self.__latencies[operation].append(seconds)
+            self.__counts[operation] += 1
+
+    def record_batch(self, size: int, queue_depth: int) -> None:
+        with self.__lock:
+            self.__batches += 1
+            self.__batched += size
+            self.__max_queue_depth = max(self.__max_queue_depth,
+                                         queue_depth + size)
+
+    def snapshot(self, queue_depth: int) -> Dict[str, Any]:
+        with self.__lock:
+            latencies = {operation: sorted(values)
+                         for operation, values in self.__latencies.items()}
+            return {
+                'queue_depth': queue_depth,
+                'max_queue_depth': self.__max_queue_depth,
+                'mean_batch_size': (self.__batched / self.__batches
+                                    if self.__batches else 0.),
+                'requests': dict(self.__counts),
+                'latency': {
+                    operation: {f'p{p}': percentile(values, p)
+                                for p in PERCENTILES}
+                    for operation, values in latencies.items()}}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.
+    rank = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[rank]
+
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(choices: Path, catalog: Path) -> None:
+    _WORKER['references'] = ReferenceManager(choices)
+    _WORKER['catalog'] = read_catalog(catalog)
+
+
+def _optimize(request: PlanRequest) -> Dict[str, Any]:
+    references = _WORKER['references']
+    references.reload()
+    plan = make_plan(references.snapshot(), _WORKER['catalog'], request)
+    return plan.optimize(request.fixed, **request.options)._asdict()
+
+
+def make_plan(references: Snapshot,
+              catalog: Mapping[str, Composition],
+              request: PlanRequest) -> FoodPlan:
+    if request.reference not in references:
+        raise ValueError(f"Unknown reference '{request.reference}'")
+    foods = []
+    for name, amount in request.foods.items():
+        if name not in catalog:
+            raise ValueError(f"Unknown food '{name}'")
+        foods.append(Food(name, catalog[name], amount))
+    return FoodPlan(foods, references[request.reference])
+
+
+class PlanService:
+    def __init__(self, choices: Path, catalog: Path,
+                 batch_size: int = 64, batch_window: float = 0.002,
+                 max_workers: Optional[int] = None,
+                 reload_interval: Optional[float] = 1.) -> None:
+        self.reference_manager = ReferenceManager(choices)
+        self.catalog = read_catalog(catalog)
+        for losses in self.references.values():
+            for loss in losses:
+                if isinstance(loss, AlgebraicLoss):
+                    loss.compiled_expression  # pylint: disable=W0104
+                    loss.grad_exprs  # pylint: disable=W0104
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.metrics = Metrics()
+        self.__queue: 'queue.Queue[Tuple[PlanRequest, Future, float]]' =\
+            queue.Queue()
+        self.__pool = ProcessPoolExecutor(
+            max_workers, initializer=_init_worker,
+            initargs=(choices, catalog))
+        self.__closed = threading.Event()
+        self.__batcher = threading.Thread(target=self.__run, daemon=True)
+        self.__batcher.start()
+        if reload_interval is not None:
+            self.reference_manager.watch(reload_interval)
+
+    @property
+    def references(self) -> Snapshot:
+        return self.reference_manager.snapshot()
+
+    def submit(self, request: PlanRequest) -> Future:
+        future: Future = Future()
+        self.__queue.put((request, future, time.perf_counter()))
+        return future
+
+    def close(self) -> None:
+        self.__closed.set()
+        self.reference_manager.stop()
+        self.__batcher.join()
+        self.__pool.shutdown()
+
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        return self.metrics.snapshot(self.__queue.qsize())
+
+    def __next_batch(self) -> List[Tuple[PlanRequest, Future, float]]:
+        try:
+            batch = [self.__queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.__queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        self.metrics.record_batch(len(batch), self.__queue.qsize())
+        return batch
+
+    def __run(self) -> None:
+        while not self.__closed.is_set():
+            groups: MutableMapping[str, List] = defaultdict(list)
+            for item in self.__next_batch():
+                request, future, start = item
+                if request.operation == 'optimize':
+                    self.__dispatch(request, future, start)
+                else:
+                    groups[request.reference].append(item)
+            for reference, items in groups.items():
+                try:
+                    self.__evaluate(reference, items)
+                except Exception as error:  # pylint: disable=broad-except
+                    # never let one batch stop the batcher
+                    for request, future, start in items:
+                        if not future.done():
+                            self.__finish(request.operation, future, start,
+                                          error=error)
+
+    def __finish(self, operation: str, future: Future, start: float,
+                 result: Any = None,
+                 error: Optional[BaseException] = None) -> None:
+        self.metrics.record(operation, time.perf_counter() - start)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def __dispatch(self, request: PlanRequest, future: Future,
+                   start: float) -> None:
+        def done(solve: Future) -> None:
+            try:
+                result = solve.result()
+            except BaseException as error:  # pylint: disable=broad-except
+                self.__finish(request.operation, future, start, error=error)
+            else:
+                self.__finish(request.operation, future, start, result)
+        try:
+            self.__pool.submit(_optimize, request).add_done_callback(done)
+        except Exception as error:  # pylint: disable=broad-except
+            self.__finish(request.operation, future, start, error=error)
+
+    def __evaluate(self, reference: str,
+                   items: List[Tuple[PlanRequest, Future, float]]) -> None:
+        """
+        Evaluates a batch sharing one reference loss by loss,
+        so each compiled loss runs over all plans in turn
+
+        A failure in one request is set on its future only
+        """
+        references = self.references
+        plans: List[Tuple[FoodPlan, PlanRequest, Future, float]] = []
+        totals = []
+        for request, future, start in items:
+            try:
+                plan = make_plan(references, self.catalog, request)
+                totals.append(plan.totals(pruned=True))
+            except Exception as error:  # pylint: disable=broad-except
+                self.__finish(request.operation, future, start, error=error)
+                continue
+            plans.append((plan, request, future, start))
+        values = [0.] * len(plans)
+        gradients = [NutrientInfo() for _ in plans]
+        errors: List[Optional[Exception]] = [None] * len(plans)
+        for loss in references.get(reference, ()):
+            for i, (_, request, _, _) in enumerate(plans):
+                if errors[i] is not None:
+                    continue
+                try:
+                    if request.operation == 'evaluate':
+                        values[i] += loss.loss(totals[i])
+                    else:
+                        gradients[i] += loss.gradient(totals[i], sparse=True)
+                except Exception as error:  # pylint: disable=broad-except
+                    errors[i] = error
+        for i, (plan, request, future, start) in enumerate(plans):
+            result: Dict[str, Any] = {'loss': values[i]}
+            if errors[i] is None and request.operation == 'gradient':
+                try:
+                    result = {'gradient': plan.gradient(gradients[i])}
+                except Exception as error:  # pylint: disable=broad-except
+                    errors[i] = error
+            self.__finish(request.operation, future, start, result,
+                          errors[i])
+
+
+class PlanHandler(BaseHTTPRequestHandler):
+    service: PlanService
+    result_timeout: float = 300.
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path.rstrip('/') != '/metrics':
+            self.__reply(404, {'error': f"Unknown path '{self.path}'"})
+            return
+        self.__reply(200, self.service.metrics_snapshot())
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = PlanRequest.from_json(
+                self.path.strip('/'), json.loads(self.rfile.read(length)))
+        except ValueError as error:
+            self.__reply(400, {'error': str(error)})
+            return
+        try:
+            result = self.service.submit(request).result(self.result_timeout)
+        except futures.TimeoutError:
+            self.__reply(504, {'error': "Timed out waiting for the result"})
+            return
+        except ValueError as error:
+            self.__reply(400, {'error': str(error)})
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            self.__reply(500, {'error': f"{type(error).__name__}: {error}"})
+            return
+        self.__reply(200, result)
+
+    def __reply(self, status: int, body: Mapping[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_: Any) -> None:
+        pass
+
+
+def serve(service: PlanService, host: str = 'localhost', port: int = 8080,
+          result_timeout: float = PlanHandler.result_timeout)\
+        -> ThreadingHTTPServer:
+    handler = type('BoundPlanHandler', (PlanHandler,), {
+        'service': service, 'result_timeout': result_timeout})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('choices', type=Path)
+    parser.add_argument('catalog', type=Path)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    service = PlanService(args.choices, args.catalog,
+                          max_workers=args.workers)
+    server = serve(service, args.host, args.port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
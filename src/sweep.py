@@ -0,0 +1,129 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import (
+    Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union)
+
+from sympy import Symbol, sympify  # type: ignore
+
+from .food_plan import Food, FoodPlan, Solution
+from .loss import AlgebraicLoss, Loss, Target
+
+
+class TargetArgument(NamedTuple):
+    """
+    An argument of the targets on a nutrient, swept as a parameter,
+    e.g. `TargetArgument('protein', 'low_penalty')`
+    """
+    nutrient: str
+    argument: str = 'target'
+
+    @property
+    def symbol(self) -> Symbol:
+        return Symbol(f"{self.nutrient}.{self.argument}")
+
+
+Parameter = Union[Symbol, TargetArgument]
+
+
+class SweepPoint(NamedTuple):
+    parameters: Mapping[Parameter, float]
+    solution: Solution
+
+
+def substitute(losses: Sequence[Loss],
+               values: Mapping[Symbol, float]) -> List[Loss]:
+    """
+    Losses with parameters replaced by values
+
+    Losses without any of the parameters are kept as they are,
+    so their compiled forms are reused
+    """
+    return [loss.subs(values)
+            if isinstance(loss, AlgebraicLoss) and loss.symbols & set(values)
+            else loss
+            for loss in losses]
+
+
+def parameterize(losses: Sequence[Loss], key: TargetArgument) -> List[Loss]:
+    """
+    Losses with the argument of the targets on a nutrient
+    replaced by the key's symbol
+    """
+    if key.argument not in Target.ARGUMENTS[1:]:
+        raise ValueError(f"Cannot sweep Target argument '{key.argument}'")
+    parameterized = [
+        loss.replace(**{key.argument: key.symbol})
+        if (isinstance(loss, Target) and
+            str(loss.arguments['expr']) == key.nutrient)
+        else loss
+        for loss in losses]
+    if all(new is old for new, old in zip(parameterized, losses)):
+        raise ValueError(f"No Target on '{key.nutrient}' to sweep")
+    return parameterized
+
+
+def sweep_line(plan: FoodPlan, axis: Symbol, values: Sequence[float],
+               others: Mapping[Symbol, float],
+               fixed: Optional[Mapping[str, float]] = None,
+               **options: Any) -> List[SweepPoint]:
+    """
+    Solves the plan for each value of one parameter in turn,
+    starting each solve from the previous solution
+    """
+    losses = list(plan.losses)
+    plan = FoodPlan((Food(food.name, food.composition, food.amount)
+                     for food in plan), losses)
+    points = []
+    for value in values:
+        parameters = dict(others)
+        parameters[axis] = value
+        plan.losses = substitute(losses, parameters)
+        points.append(SweepPoint(parameters, plan.optimize(fixed, **options)))
+    return points
+
+
+def sweep(plan: FoodPlan,
+          parameters: Mapping[Union[str, Parameter], Sequence[float]],
+          fixed: Optional[Mapping[str, float]] = None,
+          processes: Optional[int] = None,
+          **options: Any) -> List[SweepPoint]:
+    """
+    Solves the plan over a grid of parameter values in the losses
+
+    The first parameter is swept along lines warm-started from one point
+    to the next; each combination of the other parameters is a separate
+    line, and lines run in parallel processes unless `processes` is 0.
+    Points come back in grid order, first parameter varying fastest.
+    Besides symbols in the losses, a parameter can be a TargetArgument,
+    which sweeps e.g. the target of an energy Target read from a file
+    """
+    if not parameters:
+        raise ValueError("Cannot sweep without parameters")
+    grid: Dict[Symbol, Sequence[float]] = {}
+    keys: Dict[Symbol, Parameter] = {}
+    losses = list(plan.losses)
+    for key, values in parameters.items():
+        if isinstance(key, TargetArgument):
+            losses = parameterize(losses, key)
+            symbol = key.symbol
+            keys[symbol] = key
+        else:
+            symbol = sympify(key)
+            keys[symbol] = symbol
+        grid[symbol] = values
+    plan = FoodPlan(plan, losses)
+    axis, *rest = grid
+    lines: List[Tuple[Any, ...]] = [
+        (plan, axis, grid[axis], dict(zip(rest, combination)), fixed)
+        for combination in product(*(grid[key] for key in rest))]
+    if processes == 0 or len(lines) == 1:
+        curves = [sweep_line(*line, **options) for line in lines]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(sweep_line, *line, **options)
+                       for line in lines]
+            curves = [future.result() for future in futures]
+    return [SweepPoint({keys[symbol]: value
+                        for symbol, value in point.parameters.items()},
+                       point.solution)
+            for curve in curves for point in curve]
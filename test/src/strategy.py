@@ -65,8 +65,14 @@ def from_or_0(min_value: float = 0) -> st.SearchStrategy[float]:
 st.register_type_strategy(float, reals())
 st.register_type_strategy(Nutrient, nutrients())
 st.register_type_strategy(NutrientInfo, nut_infos())
-# pylint: disable=no-member
-st.register_type_strategy(
-    Tuple[NutrientInfo, Nutrient],
-    collections_with_elements(1, nut_infos())
-    .map(lambda pair: (pair[0], pair[1][0])))
+
+
+def _tuples(typ: Type) -> st.SearchStrategy:
+    # hypothesis only registers generic types through their origin
+    if typ == Tuple[NutrientInfo, Nutrient]:
+        return (collections_with_elements(1, nut_infos())
+                .map(lambda pair: (pair[0], pair[1][0])))
+    return NotImplemented
+
+
+st.register_type_strategy(tuple, _tuples)
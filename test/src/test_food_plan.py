@@ -0,0 +1,190 @@
+import math
+import os
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+
+from hypothesis import given, infer
+from sympy import Symbol  # type: ignore
+
+import test.src.base as base
+import test.src.strategy as sty
+from src.nutritional_info import NutrientInfo
+from src.loss import AlgebraicLoss, Target
+from src.food_plan import Food, FoodPlan, Composition
+
+
+class TestFood(base.AdvancedTestCase):
+    @given(nut_info=infer)
+    def test_composition_shared(self, nut_info: NutrientInfo):
+        food0 = Food("a", nut_info)
+        food1 = Food("b", NutrientInfo(nut_info))
+        self.assertIs(food0.composition, food1.composition)
+        self.assertIs(Composition.of(food0.composition), food0.composition)
+
+    def test_pickle_rebuilds_interned(self):
+        # hashes of symbol names depend on the seed of the pickling process
+        code = ("import pickle, sys; from sympy import Symbol; "
+                "from src.food_plan import Composition; "
+                "sys.stdout.buffer.write(pickle.dumps("
+                "Composition.of({Symbol('protein'): 1.})))")
+        data = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, check=True,
+            cwd=Path(__file__).parents[2],
+            env=dict(os.environ, PYTHONHASHSEED='1')).stdout
+        composition = Composition.of({Symbol('protein'): 1.})
+        self.assertIs(pickle.loads(data), composition)
+        self.assertEqual(hash(pickle.loads(data)), hash(composition))
+
+    def test_missing_nutrient(self):
+        food = Food("a", {Symbol('protein'): 1.})
+        with self.assertRaises(KeyError):
+            food[Symbol('fat')]  # pylint: disable=pointless-statement
+        self.assertEqual(food.get(Symbol('fat'), 2.), 2.)
+
+    def test_scale(self):
+        food = Food("a", {Symbol('protein'): 1.})
+        self.assertEqual(food * 2., NutrientInfo({Symbol('protein'): 2.}))
+        self.assertEqual(2. * food, NutrientInfo({Symbol('protein'): 2.}))
+        with self.assertRaises(TypeError):
+            food * "2"  # pylint: disable=pointless-statement
+
+    def test_slots(self):
+        food = Food("a", NutrientInfo())
+        with self.assertRaises(AttributeError):
+            food.extra = 1
+
+    @given(nut_info=infer, amount=sty.reals(max_value=1e100))
+    def test_nutrients(self, nut_info: NutrientInfo, amount: float):
+        food = Food("a", nut_info, amount)
+        self.assertTrue(NutrientInfo.isclose(food.nutrients(),
+                                             nut_info * amount))
+
+    @given(nut_info0=infer, nut_info1=infer,
+           amount0=sty.reals(max_value=1e100),
+           amount1=sty.reals(max_value=1e100))
+    def test_accumulate(self, nut_info0: NutrientInfo, nut_info1: NutrientInfo,
+                        amount0: float, amount1: float):
+        buffer = NutrientInfo()
+        Food("a", nut_info0, amount0).accumulate(buffer)
+        Food("b", nut_info1, amount1).accumulate(buffer)
+        self.assertTrue(NutrientInfo.isclose(
+            buffer, nut_info0 * amount0 + nut_info1 * amount1))
+
+    @given(nut_info=infer)
+    def test_accumulate_zero_amount(self, nut_info: NutrientInfo):
+        food = Food("a", nut_info, 0)
+        buffer = food.accumulate(NutrientInfo())
+        self.assertEqual(set(buffer), set(food.composition))
+        for value in buffer.values():
+            self.assertEqual(value, 0)
+
+    @given(nut_info0=infer, nut_info1=infer)
+    def test_dot(self, nut_info0: NutrientInfo, nut_info1: NutrientInfo):
+        self.assertTrue(math.isclose(Food("a", nut_info0) * nut_info1,
+                                     nut_info0 * nut_info1))
+
+
+class TestFoodPlan(base.AdvancedTestCase):
+    def setUp(self):
+        protein, energy = Symbol('protein'), Symbol('energy')
+        self.plan = FoodPlan(
+            [Food("a", {protein: 1, energy: 2}, 1),
+             Food("b", {energy: 3}, 2)],
+            [AlgebraicLoss((protein - 0.1 * energy)**2 + energy**3 / 1000)])
+
+    def test_hessian(self):
+        hessian = self.plan.hessian()
+        step = 1e-6
+        for food in self.plan:
+            gradient = self.plan.gradient()
+            food.amount += step
+            shifted = self.plan.gradient()
+            food.amount -= step
+            for name, value in shifted.items():
+                self.assertAlmostEqual(
+                    hessian[name, food.name],
+                    (value - gradient[name]) / step, places=4)
+
+    def test_hessian_vector_product(self):
+        hessian = self.plan.hessian()
+        direction = {"a": 0.5, "b": -2}
+        product = self.plan.hessian_vector_product(direction)
+        for food in self.plan:
+            self.assertAlmostEqual(
+                product[food.name],
+                sum(hessian[food.name, name] * value
+                    for name, value in direction.items()))
+
+    def test_newton(self):
+        protein, energy = Symbol('protein'), Symbol('energy')
+        self.plan.losses = [
+            AlgebraicLoss((protein - 1)**2 + (energy - 10)**2 / 100)]
+        solution = self.plan.optimize(method='newton', tolerance=1e-10)
+        self.assertLess(solution.iterations, 50)
+        for food in self.plan:
+            self.assertGreater(food.amount, 0)
+        for value in self.plan.gradient().values():
+            self.assertAlmostEqual(value, 0)
+
+    def test_newton_targets(self):
+        protein, energy = Symbol('protein'), Symbol('energy')
+        self.plan.losses = [Target.symmetric(energy, 20),
+                            Target.min_limit(protein, 3)]
+        solution = self.plan.optimize(method='newton')
+        self.assertLess(solution.loss, 1e-3)
+        self.assertGreaterEqual(self.plan.totals()[protein], 3 - 1e-3)
+        self.assertAlmostEqual(self.plan.totals()[energy], 20, places=3)
+
+    def test_gradient_targets(self):
+        protein, energy = Symbol('protein'), Symbol('energy')
+        plan = FoodPlan([Food("bread", {energy: 250, protein: 10}),
+                         Food("beans", {energy: 100, protein: 20})],
+                        [Target.symmetric(energy, 2000),
+                         Target.min_limit(protein, 60)])
+        solution = plan.optimize()
+        self.assertLess(solution.iterations, 100)
+        self.assertLess(solution.loss, 1e-3)
+
+    def test_attribution(self):
+        protein, energy = Symbol('protein'), Symbol('energy')
+        self.plan.losses.append(Target.min_limit(protein, 3))
+        attribution = self.plan.attribution()
+        self.assertEqual(attribution.foods, ["a", "b"])
+        self.assertEqual(attribution.deviation, [None, -2])
+        self.assertEqual(attribution.share, [[None, 1], [None, 0]])
+        gradient = self.plan.gradient()
+        for i, food in enumerate(self.plan):
+            self.assertAlmostEqual(sum(attribution.gradient[i]),
+                                   gradient[food.name])
+            self.assertAlmostEqual(
+                sum(attribution.contribution[i]),
+                food.amount * gradient[food.name])
+            total = self.plan.total_loss()
+            amount, food.amount = food.amount, 0
+            self.assertAlmostEqual(sum(attribution.leave_one_out[i]),
+                                   self.plan.total_loss() - total)
+            food.amount = amount
+
+    def test_nutrient_missing_from_foods(self):
+        energy, fibre = Symbol('energy'), Symbol('fibre')
+        plan = FoodPlan([Food("bread", {energy: 250}, 1)],
+                        [Target.min_limit(fibre, 30)])
+        self.assertEqual(plan.totals(pruned=True)[fibre], 0)
+        self.assertEqual(plan.total_loss(), 30)
+        self.assertEqual(plan.gradient(), {"bread": 0})
+        self.assertEqual(plan.attribution().deviation, [-30])
+
+    def test_pruned(self):
+        water = Symbol('water')
+        self.plan.append(Food("c", {water: 100}, 1))
+        self.assertEqual(self.plan.symbols,
+                         {Symbol('protein'), Symbol('energy')})
+        self.assertNotIn(water, self.plan.totals(pruned=True))
+        self.assertEqual(self.plan.projections(),
+                         [self.plan.projected(food) for food in self.plan])
+        self.assertEqual(self.plan.totals()[water], 100)
+        self.assertEqual(self.plan.gradient()["c"], 0)
+        self.assertNotIn(water, self.plan.nutrient_gradient())
+        self.assertEqual(self.plan.nutrient_gradient(dense=True)[water], 0)
@@ -4,12 +4,12 @@ from collections import ChainMap
 from typing import Tuple
 
 from hypothesis import given, settings, infer, assume
-from hypothesis.strategies as st
+import hypothesis.strategies as st
 from sympy import sympify, Symbol, Expr  # type: ignore
 
 import test.src.base as base
 import test.src.strategy as sty
-from src.nutritional_info import NutrientInfo, CALORIC_VALUE
+from src.nutritional_info import Nutrient, NutrientInfo, CALORIC_VALUE
 from src.loss import AlgebraicLoss, Target, Gradient
 
 
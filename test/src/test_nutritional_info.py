@@ -1,4 +1,5 @@
 import math
+import pickle
 from copy import deepcopy
 from itertools import chain
 from typing import Set, Mapping, List, Iterable
@@ -8,7 +9,15 @@ from hypothesis import given, infer, assume
 from sympy import Symbol  # type: ignore
 
 import test.src.base as base
-from src.nutritional_info import NutrientInfo, VOID_NUTRIENT_INFO
+from src.nutritional_info import Nutrient, NutrientInfo, VOID_NUTRIENT_INFO
+
+
+class TestNutrient(base.AdvancedTestCase):
+    def test_pickle(self):
+        nutrient = Nutrient('energy')
+        copy = pickle.loads(pickle.dumps(nutrient))
+        self.assertEqual(copy, nutrient)
+        self.assertTrue(copy.is_real)
 
 
 class TestNutrientInfo(base.AdvancedTestCase):
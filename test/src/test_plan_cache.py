@@ -0,0 +1,87 @@
+import unittest
+from typing import Mapping
+
+from sympy import Symbol  # type: ignore
+
+from src.nutritional_info import NutrientInfo
+from src.loss import Loss, Gradient
+from src.food_plan import Food, FoodPlan
+from src.plan_cache import SolutionCache
+
+ENERGY = Symbol('energy')
+PROTEIN = Symbol('protein')
+
+
+class Quadratic(Loss):
+    def __init__(self, targets: Mapping[Symbol, float]) -> None:
+        super().__init__()
+        self.targets = targets
+
+    def loss(self, value: NutrientInfo) -> float:
+        return sum((value[key] - target) ** 2
+                   for key, target in self.targets.items())
+
+    def gradient(self, nutrient_info: NutrientInfo,
+                 sparse: bool = False) -> Gradient:
+        return Gradient({key: 2 * (nutrient_info[key] - target)
+                         for key, target in self.targets.items()})
+
+
+LOSS = Quadratic({ENERGY: 2., PROTEIN: 0.3})
+
+
+def make_plan(*names: str) -> FoodPlan:
+    catalog = {'bread': {ENERGY: 2.5, PROTEIN: 0.1},
+               'beans': {ENERGY: 1., PROTEIN: 0.2},
+               'cheese': {ENERGY: 4., PROTEIN: 0.25}}
+    return FoodPlan((Food(name, catalog[name]) for name in names),
+                    [LOSS])
+
+
+class TestSolutionCache(unittest.TestCase):
+    options = dict(speed=0.1, max_iterations=10000, tolerance=1e-8)
+
+    def test_hit(self):
+        cache = SolutionCache()
+        solution = cache.solve(make_plan('bread', 'beans'), **self.options)
+        plan = make_plan('bread', 'beans')
+        self.assertEqual(cache.solve(plan, **self.options), solution)
+        self.assertEqual(plan.amounts(), solution.amounts)
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+        self.assertEqual(cache.stats.iterations_saved, solution.iterations)
+
+    def test_options_in_key(self):
+        cache = SolutionCache()
+        rough = cache.solve(make_plan('bread', 'beans'), speed=0.1,
+                            max_iterations=1)
+        solution = cache.solve(make_plan('bread', 'beans'), **self.options)
+        self.assertEqual(cache.stats.hits, 0)
+        self.assertEqual(cache.stats.misses, 2)
+        self.assertLess(solution.loss, rough.loss)
+
+    def test_duplicate_losses(self):
+        cache = SolutionCache()
+        cache.solve(make_plan('bread', 'beans'), **self.options)
+        plan = make_plan('bread', 'beans')
+        plan.losses.append(LOSS)
+        cache.solve(plan, **self.options)
+        self.assertEqual(cache.stats.hits, 0)
+
+    def test_warm_start(self):
+        cache = SolutionCache()
+        cold = cache.solve(make_plan('bread', 'beans'), **self.options)
+        warm = cache.solve(make_plan('bread', 'beans', 'cheese'),
+                           fixed={'cheese': 0}, **self.options)
+        self.assertEqual(cache.stats.warm_starts, 1)
+        self.assertLess(warm.iterations, cold.iterations)
+        self.assertAlmostEqual(warm.loss, cold.loss)
+
+    def test_eviction(self):
+        cache = SolutionCache(maxsize=1)
+        cache.solve(make_plan('bread'), **self.options)
+        cache.solve(make_plan('beans'), **self.options)
+        self.assertEqual(len(cache), 1)
+        cache.solve(make_plan('bread'), **self.options)
+        self.assertEqual(cache.stats.hits, 0)
+        self.assertEqual(cache.stats.misses, 3)
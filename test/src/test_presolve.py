@@ -0,0 +1,57 @@
+import unittest
+
+from sympy import Symbol  # type: ignore
+
+from src.loss import AlgebraicLoss, Target
+from src.food_plan import Food, FoodPlan
+from src.presolve import loss_directions, presolve
+
+ENERGY, PROTEIN, WATER = Symbol('energy'), Symbol('protein'), Symbol('water')
+
+
+class TestPresolve(unittest.TestCase):
+    def setUp(self):
+        self.plan = FoodPlan(
+            [Food("bread", {ENERGY: 250, PROTEIN: 9, WATER: 40}, 1),
+             Food("toast", {ENERGY: 500, PROTEIN: 18}, 1),
+             Food("water", {WATER: 100}, 3),
+             Food("beans", {ENERGY: 100, PROTEIN: 20}),
+             Food("tofu", {ENERGY: 80, PROTEIN: 20}),
+             Food("salt", {ENERGY: 0})],
+            [Target.symmetric(ENERGY, 2000), Target.min_limit(PROTEIN, 60)])
+
+    def test_irrelevant_and_merged(self):
+        presolved = presolve(self.plan, fixed={"salt": 0})
+        self.assertEqual(presolved.irrelevant, ["water"])
+        self.assertEqual(presolved.forced_zero, ["salt"])
+        self.assertEqual(dict(presolved.merged), {"bread": [("toast", 2.)]})
+        self.assertEqual(presolved.eliminated, 3)
+        bread, = (food for food in presolved.plan if food.name == "bread")
+        self.assertEqual(bread.amount, 3)
+        self.assertAlmostEqual(presolved.plan.total_loss(),
+                               self.plan.total_loss())
+
+    def test_dominated(self):
+        self.plan.losses = [Target.max_limit(ENERGY, 2000),
+                            Target.min_limit(PROTEIN, 60)]
+        self.assertEqual(loss_directions(self.plan.losses),
+                         {ENERGY: -1, PROTEIN: 1})
+        presolved = presolve(self.plan)
+        self.assertEqual(dict(presolved.dominated),
+                         {"bread": "beans", "beans": "tofu"})
+        tofu, = presolved.plan
+        self.assertEqual(tofu.name, "tofu")
+        self.assertEqual(tofu.amount, 3)
+
+    def test_not_monotone(self):
+        self.assertEqual(loss_directions(self.plan.losses), {PROTEIN: 1})
+        self.assertEqual(presolve(self.plan).dominated, {})
+        self.plan.losses.append(AlgebraicLoss((PROTEIN - 2 * ENERGY)**2))
+        self.assertEqual(loss_directions(self.plan.losses), {})
+
+    def test_restore(self):
+        presolved = presolve(self.plan)
+        amounts = presolved.restore({"bread": 2, "beans": 1, "tofu": 0.5})
+        self.assertEqual(amounts["toast"], 0)
+        self.assertEqual(amounts["water"], 0)
+        self.assertEqual(amounts["bread"], 2)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import time
+import unittest
+import warnings
+from pathlib import Path
+
+from src.reference_manager import ReferenceManager
+
+HEADER = "name,loss-type (default: target-sym),parameters\n"
+
+
+class TestReferenceManager(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        root = Path(self.directory.name)
+        self.reference = root / "reference.csv"
+        self.write("energy,,2000\nprotein,min,60\n")
+        self.choices = root / "choices.csv"
+        self.choices.write_text(f"test,{self.reference}\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text: str) -> None:
+        self.reference.write_text(HEADER + text)
+
+    def test_unchanged(self):
+        manager = ReferenceManager(self.choices)
+        snapshot = manager.snapshot()
+        self.assertEqual(manager.reload(), set())
+        self.assertIs(manager.snapshot(), snapshot)
+
+    def test_changed_rows_only(self):
+        manager = ReferenceManager(self.choices)
+        old = manager.snapshot()
+        energy, protein = old["test"]
+        self.write("energy,,2000\nprotein,min,55\nfat,max,97\n")
+        self.assertEqual(manager.reload(), {"test"})
+        new = manager.snapshot()["test"]
+        self.assertIs(new[0], energy)
+        self.assertIsNot(new[1], protein)
+        self.assertEqual(len(new), 3)
+        self.assertEqual(old["test"], (energy, protein))
+        self.assertEqual(manager.stats.rows_reused, 1)
+        self.assertEqual(manager.stats.rows_rebuilt, 4)
+        self.assertEqual(manager.stats.reloads, 1)
+
+    def test_same_stamp(self):
+        manager = ReferenceManager(self.choices)
+        stat = self.reference.stat()
+        self.write("energy,,2000\nprotein,min,55\n")
+        # an edit of the same size within one mtime tick
+        os.utime(self.reference, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(manager.reload(), {"test"})
+        self.assertEqual(manager.reload(), set())
+        self.assertEqual(manager.stats.reloads, 1)
+
+    def test_watch_survives_bad_edit(self):
+        manager = ReferenceManager(self.choices)
+        old = manager.snapshot()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            manager.watch(interval=0.01)
+            try:
+                self.write("energy,,2000\nprotein,target-asym,60\n")
+                time.sleep(0.1)
+                self.assertIs(manager.snapshot(), old)
+                self.write("energy,,2500\nprotein,min,60\n")
+                deadline = time.monotonic() + 10
+                while (manager.snapshot() is old and
+                       time.monotonic() < deadline):
+                    time.sleep(0.01)
+            finally:
+                manager.stop()
+        energy, protein = manager.snapshot()["test"]
+        self.assertIsNot(energy, old["test"][0])
+        self.assertIs(protein, old["test"][1])
@@ -0,0 +1,176 @@
+import json
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from src.reference_manager import ReferenceManager
+from src.service import (
+    Metrics, PlanRequest, PlanService, percentile, serve)
+
+DATA = Path(__file__).parents[2] / 'data'
+
+TIMEOUT = 60
+
+
+class TestPlanRequest(unittest.TestCase):
+    def test_valid(self):
+        request = PlanRequest.from_json('optimize', {
+            'reference': 'test', 'foods': {'bread': 1},
+            'options': {'max_iterations': 10, 'method': 'newton'}})
+        self.assertEqual(request.foods, {'bread': 1.})
+        self.assertEqual(request.options['method'], 'newton')
+
+    def test_invalid(self):
+        for operation, body in [
+                ('fly', {'reference': 'test'}),
+                ('evaluate', ['test']),
+                ('evaluate', {}),
+                ('evaluate', {'reference': 'test', 'foods': {'bread': 'x'}}),
+                ('evaluate', {'reference': 'test', 'foods': ['bread']}),
+                ('evaluate', {'reference': 'test', 'fixed': {'bread': True}}),
+                ('optimize', {'reference': 'test', 'options': {'fast': 1}}),
+                ('optimize', {'reference': 'test',
+                              'options': {'max_iterations': 1.5}})]:
+            with self.assertRaises(ValueError):
+                PlanRequest.from_json(operation, body)
+
+
+class ServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        root = Path(self.directory.name)
+        reference = root / "reference.csv"
+        reference.write_text("name,loss-type (default: target-sym),"
+                             "parameters\nenergy,,2000\nprotein,min,60\n")
+        choices = root / "choices.csv"
+        choices.write_text(f"test,{reference}\n")
+        catalog = root / "catalog.csv"
+        catalog.write_text("name,energy,protein\n"
+                           "bread,250,10\nbeans,100,20\n")
+        self.service = PlanService(choices, catalog, max_workers=1,
+                                   reload_interval=None)
+
+    def tearDown(self):
+        self.service.close()
+        self.directory.cleanup()
+
+    def run_request(self, operation, foods, **kwargs):
+        return self.service.submit(
+            PlanRequest(operation, 'test', foods, **kwargs)).result(TIMEOUT)
+
+
+class TestPlanService(ServiceTestCase):
+    def test_round_trip(self):
+        foods = {'bread': 4., 'beans': 2.}
+        evaluated = self.run_request('evaluate', foods)
+        self.assertAlmostEqual(evaluated['loss'], 800)
+        gradient = self.run_request('gradient', foods)['gradient']
+        self.assertEqual(set(gradient), {'bread', 'beans'})
+        self.assertLess(gradient['bread'], 0)
+        solution = self.run_request('optimize', foods, options={
+            'method': 'newton', 'max_iterations': 200})
+        self.assertLess(solution['loss'], evaluated['loss'])
+        self.assertEqual(set(solution['amounts']), {'bread', 'beans'})
+        metrics = self.service.metrics_snapshot()
+        self.assertEqual(metrics['requests'],
+                         {'evaluate': 1, 'gradient': 1, 'optimize': 1})
+
+    def test_bad_requests_do_not_wedge(self):
+        # requests built directly skip from_json validation
+        with self.assertRaises(TypeError):
+            self.run_request('evaluate', {'bread': 'x'})
+        with self.assertRaises(AttributeError):
+            self.run_request('gradient', ['bread'])
+        with self.assertRaises(ValueError):
+            self.run_request('evaluate', {'toast': 1.})
+        with self.assertRaises(TypeError):
+            self.run_request('optimize', {'bread': 1.},
+                             options={'nonsense': 1})
+        with self.assertRaises(ValueError):
+            self.service.submit(
+                PlanRequest('gradient', 'missing', {})).result(TIMEOUT)
+        self.assertIn('loss', self.run_request('evaluate', {'bread': 1.}))
+        self.assertIn('amounts', self.run_request('optimize', {'bread': 1.}))
+
+
+class TestPlanHandler(ServiceTestCase):
+    def start(self, **kwargs):
+        server = serve(self.service, port=0, **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return f"http://localhost:{server.server_address[1]}"
+
+    @staticmethod
+    def fetch(url, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        try:
+            with urllib.request.urlopen(url, data, timeout=TIMEOUT) as reply:
+                return reply.status, json.load(reply)
+        except urllib.error.HTTPError as error:
+            with error:
+                return error.code, json.load(error)
+
+    def test_status_codes(self):
+        url = self.start()
+        status, body = self.fetch(f"{url}/evaluate", {
+            'reference': 'test', 'foods': {'bread': 4, 'beans': 2}})
+        self.assertEqual(status, 200)
+        self.assertAlmostEqual(body['loss'], 800)
+        for path, request in [
+                ('evaluate', {'reference': 'test', 'foods': {'bread': 'x'}}),
+                ('evaluate', {'reference': 'test', 'foods': {'toast': 1}}),
+                ('fly', {'reference': 'test'})]:
+            status, body = self.fetch(f"{url}/{path}", request)
+            self.assertEqual(status, 400)
+            self.assertIn('error', body)
+        status, body = self.fetch(f"{url}/metrics")
+        self.assertEqual(status, 200)
+        self.assertEqual(body['requests'], {'evaluate': 2})
+        self.assertEqual(self.fetch(f"{url}/missing")[0], 404)
+
+    def test_timeout(self):
+        url = self.start(result_timeout=1e-6)
+        status, _ = self.fetch(f"{url}/optimize", {
+            'reference': 'test', 'foods': {'bread': 1}})
+        self.assertEqual(status, 504)
+
+
+class TestShippedReferences(unittest.TestCase):
+    def test_load(self):
+        references = ReferenceManager(DATA / 'choices.csv').snapshot()
+        self.assertTrue(references)
+        for losses in references.values():
+            self.assertTrue(losses)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_snapshot(self):
+        metrics = Metrics(window=2)
+        for seconds in (3., 1., 2.):
+            metrics.record('evaluate', seconds)
+        metrics.record_batch(3, queue_depth=1)
+        metrics.record_batch(1, queue_depth=0)
+        snapshot = metrics.snapshot(queue_depth=5)
+        self.assertEqual(snapshot['queue_depth'], 5)
+        self.assertEqual(snapshot['max_queue_depth'], 4)
+        self.assertEqual(snapshot['mean_batch_size'], 2)
+        self.assertEqual(snapshot['requests'], {'evaluate': 3})
+        self.assertEqual(snapshot['latency']['evaluate'],
+                         {'p50': 1., 'p90': 2., 'p99': 2.})
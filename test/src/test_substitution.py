@@ -0,0 +1,75 @@
+import random
+import unittest
+
+from sympy import Symbol  # type: ignore
+
+from src.loss import Target
+from src.food_plan import Composition, Food, FoodPlan
+from src.substitution import SubstitutionIndex
+
+ENERGY, PROTEIN, FAT = Symbol('energy'), Symbol('protein'), Symbol('fat')
+
+CATALOG = {
+    "bread": Composition.of({ENERGY: 250, PROTEIN: 9, FAT: 3}),
+    "rolls": Composition.of({ENERGY: 260, PROTEIN: 8, FAT: 4}),
+    "beans": Composition.of({ENERGY: 100, PROTEIN: 20, FAT: 1}),
+    "tofu": Composition.of({ENERGY: 80, PROTEIN: 18, FAT: 5}),
+    "butter": Composition.of({ENERGY: 700, FAT: 80})}
+CATEGORIES = {"bread": "grain", "rolls": "grain", "beans": "legume",
+              "tofu": "legume", "butter": "dairy"}
+
+
+class TestSubstitutionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SubstitutionIndex(CATALOG, categories=CATEGORIES,
+                                       block_size=2)
+
+    def test_exact(self):
+        results = self.index.search(CATALOG["bread"], k=2)
+        self.assertEqual([result.name for result in results],
+                         ["bread", "rolls"])
+        self.assertAlmostEqual(results[0].similarity, 1)
+
+    def test_filters(self):
+        results = self.index.search(CATALOG["beans"], k=5,
+                                    categories={"legume", "dairy"},
+                                    exclude={"beans"})
+        self.assertEqual([result.name for result in results][0], "tofu")
+        self.assertEqual(len(results), 2)
+
+    def test_approximate(self):
+        with self.assertRaises(ValueError):
+            self.index.search(CATALOG["tofu"], k=1, approximate=True)
+        self.index.build()
+        self.assertTrue(self.index.built)
+        exact = self.index.search(CATALOG["tofu"], k=1)
+        approximate = self.index.search(CATALOG["tofu"], k=1,
+                                        approximate=True)
+        self.assertEqual(approximate, exact)
+
+    def test_recall(self):
+        generator = random.Random(1)
+        symbols = [Symbol(f"n{i}") for i in range(20)]
+        catalog = {f"food{i}": Composition.of({
+            symbol: generator.random()
+            for symbol in generator.sample(symbols, 10)})
+            for i in range(2000)}
+        index = SubstitutionIndex(catalog, approximate=True)
+        found = 0
+        for name in generator.sample(list(catalog), 20):
+            exact = index.search(catalog[name], k=10)
+            approximate = index.search(catalog[name], k=10,
+                                       approximate=True)
+            found += len(set(exact) & set(approximate))
+        self.assertGreaterEqual(found / 200, 0.9)
+
+    def test_suggest_and_replace(self):
+        plan = FoodPlan([Food("bread", CATALOG["bread"], 2),
+                         Food("butter", CATALOG["butter"], 0.1)],
+                        [Target.min_limit(PROTEIN, 60)])
+        totals = plan.totals()
+        name, _ = self.index.suggest(plan, "bread", k=1)[0]
+        self.assertEqual(CATEGORIES[name], "legume")
+        plan.replace("bread", Food(name, CATALOG[name], 2), totals)
+        for key, value in plan.totals().items():
+            self.assertAlmostEqual(totals[key], value)
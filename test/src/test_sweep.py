@@ -0,0 +1,92 @@
+import unittest
+
+from sympy import Symbol  # type: ignore
+
+from src.loss import AlgebraicLoss, Target, parse_reference_row
+from src.food_plan import Food, FoodPlan
+from src.nutritional_info import parse_nutrient
+from src.sweep import TargetArgument, parameterize, substitute, sweep
+
+ENERGY, PROTEIN = Symbol('energy'), Symbol('protein')
+ENERGY_TARGET = Symbol('energy_target')
+PROTEIN_TARGET = Symbol('protein_target')
+
+
+class TestSweep(unittest.TestCase):
+    options = dict(method='newton', tolerance=1e-9)
+
+    def setUp(self):
+        self.plan = FoodPlan(
+            [Food("bread", {ENERGY: 2.5, PROTEIN: 0.1}),
+             Food("beans", {ENERGY: 1., PROTEIN: 0.2})],
+            [AlgebraicLoss((ENERGY - ENERGY_TARGET)**2),
+             AlgebraicLoss((PROTEIN - PROTEIN_TARGET)**2)])
+
+    def test_line(self):
+        points = sweep(self.plan, {'energy_target': [1.8, 2.4, 3.0],
+                                   'protein_target': [0.3]},
+                       processes=0, **self.options)
+        self.assertEqual([point.parameters[ENERGY_TARGET]
+                          for point in points], [1.8, 2.4, 3.0])
+        for point in points:
+            self.assertAlmostEqual(point.solution.loss, 0)
+        self.assertLessEqual(points[-1].solution.iterations,
+                             points[0].solution.iterations)
+        self.assertEqual(self.plan.amounts(), {"bread": 0, "beans": 0})
+
+    def test_grid_in_processes(self):
+        grid = {ENERGY_TARGET: [1.8, 3.0], PROTEIN_TARGET: [0.3, 0.4]}
+        points = sweep(self.plan, grid, processes=2, **self.options)
+        self.assertEqual(
+            [(point.parameters[ENERGY_TARGET],
+              point.parameters[PROTEIN_TARGET]) for point in points],
+            [(1.8, 0.3), (3.0, 0.3), (1.8, 0.4), (3.0, 0.4)])
+        self.assertEqual(points, sweep(self.plan, grid, processes=0,
+                                       **self.options))
+
+    def test_targets(self):
+        self.plan = FoodPlan(
+            [Food("bread", {ENERGY: 250, PROTEIN: 10}),
+             Food("beans", {ENERGY: 100, PROTEIN: 20})],
+            [Target.symmetric('energy', 'energy_target'),
+             Target.min_limit('protein', 60)])
+        losses = substitute(self.plan.losses, {ENERGY_TARGET: 1800})
+        self.assertIsInstance(losses[0], Target)
+        self.assertIs(losses[1], self.plan.losses[1])
+        values = [1800, 2100, 2400, 2700, 3000]
+        points = sweep(self.plan, {ENERGY_TARGET: values}, processes=0,
+                       method='newton', max_iterations=200)
+        for value, point in zip(values, points):
+            self.assertLess(point.solution.loss, 1e-3)
+            energy = sum(amount * (250 if name == "bread" else 100)
+                         for name, amount in point.solution.amounts.items())
+            self.assertAlmostEqual(energy, value, places=2)
+
+    def test_target_arguments(self):
+        energy, protein = parse_nutrient('energy'), parse_nutrient('protein')
+        losses = [parse_reference_row(('energy', 'target-sym', '2000')),
+                  parse_reference_row(('protein', 'target-asym',
+                                       '150', '1.5', '1'))]
+        self.plan = FoodPlan(
+            [Food("bread", {energy: 250, protein: 10}),
+             Food("beans", {energy: 100, protein: 20})], losses)
+        key = TargetArgument('protein', 'low_penalty')
+        parameterized = parameterize(losses, key)
+        self.assertIs(parameterized[0], losses[0])
+        self.assertEqual(parameterized[1].arguments['low_penalty'],
+                         key.symbol)
+        self.assertEqual(parameterized[1].arguments['target'], 150)
+        for bad in (TargetArgument('fat'), TargetArgument('energy', 'expr')):
+            with self.assertRaises(ValueError):
+                parameterize(losses, bad)
+
+        key = TargetArgument('energy')
+        values = [1800, 2400, 3000]
+        points = sweep(self.plan, {key: values}, processes=0,
+                       method='newton', max_iterations=200)
+        self.assertEqual([point.parameters[key] for point in points], values)
+        for value, point in zip(values, points):
+            energy = sum(amount * (250 if name == "bread" else 100)
+                         for name, amount in point.solution.amounts.items())
+            self.assertAlmostEqual(energy, value, places=2)
+        self.assertEqual(self.plan.losses, losses)